@@ -1,42 +1,20 @@
-from pathlib import Path
-
-import polars as pl
-from utils import (
-    Drug,
-    check_col_contains,
-    extract_text_from_col,
+from pipeline import (
+    clean_rx_records,
+    drug_name_remove,
+    rx_data_dir,
+    statin_generic_to_brand_names_map,
 )
 
-# --------------------------------------------------------------------------------------
-# PART 1: LOAD DATA
-# --------------------------------------------------------------------------------------
-
-# define paths
-project_dir = Path("../../").absolute()  # relative path (do not change)
-data_dir = project_dir / "data"
-ukb_project_dir = Path("/scratch/prj/premandm/")  # absolute path (change as needed)
-ukb_user_dir = ukb_project_dir / "usr" / "luke"
-
-# define list of substrings to exclude irrelevant records
-drug_name_remove = [
-    "nystatin",
-    "ecostatin",
-    "sandostatin",
-    "ostoguard",
-    "sharpsguard",
-    "lactose powder",
-    "guardian opaque",
-    "testing",
-    "ileobag",
-]
+# define mappings of drug names (statins and other ldl lowering drugs, kept in cleaned
+# records)
+ldl_generic_to_brand_names_map = statin_generic_to_brand_names_map | {
+    "ezetimibe": ["ezetrol", "inegy"],
+}
 
-# load ldl lowering drug prescription records as LazyFrame
-ldl_file = ukb_user_dir / "rx_data" / "ldl_rx_records.parquet"
-ldl = (
-    pl.scan_parquet(ldl_file)
-    .rename({"drug_name": "prescription_text", "quantity": "quantity_text"})
-    # remove rows with irrelevant drugs/devices
-    .filter(~check_col_contains("prescription_text", "|".join(drug_name_remove)))
+# clean ldl lowering drug prescription records and write to local file
+ldl = clean_rx_records(
+    parquet_in=rx_data_dir / "ldl_rx_records.parquet",
+    parquet_out=rx_data_dir / "ldl_rx_records_clean.parquet",
+    generic_to_brand_names_map=ldl_generic_to_brand_names_map,
+    drug_name_remove=drug_name_remove,
 )
-
-
@@ -0,0 +1,689 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, List
+
+import polars as pl
+from utils import Drug, extract_text_from_col, join_regex_alternatives
+
+# --------------------------------------------------------------------------------------
+# PATHS
+# --------------------------------------------------------------------------------------
+
+project_dir = Path("../../").absolute()  # relative path (do not change)
+data_dir = project_dir / "data"
+ukb_project_dir = Path("/scratch/prj/premandm/")  # absolute path (change as needed)
+ukb_user_dir = ukb_project_dir / "usr" / "luke"
+rx_data_dir = ukb_user_dir / "rx_data"
+
+# --------------------------------------------------------------------------------------
+# DRUG NAMES
+# --------------------------------------------------------------------------------------
+
+# mapping of statin generic names to brand names
+statin_generic_to_brand_names_map = {
+    "atorvastatin": ["lipitor"],
+    "rosuvastatin": ["crestor", "ezallor"],
+    "simvastatin": ["zocor", "flolipid", "inegy", "simvador"],
+    "pitavastatin": ["livalo", "zypitamag", "nikita"],
+    "pravastatin": ["pravachol", "lipostat"],
+    "lovastatin": ["mevacor", "altroprev", "altocor"],
+    "fluvastatin": ["lescol"],
+    "cerivastatin": ["baycol", "lipobay"],
+}
+
+# list of substrings to exclude irrelevant records
+drug_name_remove = [
+    "nystatin",
+    "ecostatin",
+    "sandostatin",
+    "ostoguard",
+    "sharpsguard",
+    "lactose powder",
+    "guardian opaque",
+    "testing",
+    "ileobag",
+]
+
+# generic names of combination drug brands, in the order their strengths appear in
+# prescription text (e.g. "inegy 10mg/20mg" is ezetimibe 10mg and simvastatin 20mg)
+combination_drug_generic_names = {"inegy": ["ezetimibe", "simvastatin"]}
+
+# --------------------------------------------------------------------------------------
+# REGEX PATTERNS FOR DRUG INFORMATION EXTRACTION
+# --------------------------------------------------------------------------------------
+
+# generic number pattern (includes spaces inbetween numbers!)
+number_pattern = r"\d+(?:\.|,|\s)?\d*"
+
+# strength patterns
+strength_unit_numerators = [
+    "gram",
+    "g",
+    "milligram",
+    "mg",
+    "microgram",
+    "mcg",
+    "unit",
+    "pct",
+    r"\%",
+]
+strength_unit_denominators = [
+    "g",
+    "gram",
+    "mg",
+    "milligram",
+    "mcg",
+    "microgram",
+    "litre",
+    "l",
+    "millilitre",
+    "ml",
+    "dose",
+]
+strength_unit_pattern = (
+    rf"(?:(?:{join_regex_alternatives(strength_unit_numerators)})s?)"
+    rf"(?:/(?:{join_regex_alternatives(strength_unit_denominators)})s?)?"
+)
+strength_pattern = (
+    rf"(?:{number_pattern})\s*"
+    rf"(?:(?:{join_regex_alternatives(strength_unit_numerators)})s?)"
+    rf"(?:/(?:{join_regex_alternatives(strength_unit_denominators)})s?)?"
+)
+
+# strength unit map for later standardisation of units
+strength_unit_map = {
+    "g": ["g", "gram"],
+    "mg": ["mg", "millig", "milligram"],
+    "mcg": ["mcg", "microg", "microgram"],
+    "unit": ["unit"],
+    "l": ["l", "litre"],
+    "ml": ["ml", "millil", "millilitre"],
+    "dose": ["dose"],
+    "pct": ["%", "pct", "percent"],
+}
+# flatten to a lookup of each unit variant (singular or plural) to its standard unit
+strength_unit_lookup = {
+    value + suffix: key
+    for key, values in strength_unit_map.items()
+    for value in values
+    for suffix in ["", "s"]
+}
+
+# form mapping for standardisation and pattern (literal variants of each form)
+form_map = {
+    "tablet": [
+        "tablets",
+        "tablet",
+        "tabs",
+        "tab",
+        "capsules",
+        "capsule",
+        "caps",
+        "cap",
+        "pastilles",
+        "pastille",
+        "pastils",
+        "pastil",
+    ],
+    "suspension": [
+        "suspensions",
+        "suspension",
+        "susp",
+        "sus",
+        "mixtures",
+        "mixture",
+        "powders",
+        "powder",
+    ],
+    "oral_solution": [
+        "oral solutions",
+        "oral solution",
+        "oral sol",
+        "oral liquids",
+        "oral liquid",
+        "oral liq",
+        "sachets",
+        "sachet",
+        "sach",
+    ],
+    "injection": [
+        "injections",
+        "injection",
+        "inj",
+        "pens",
+        "pen",
+        "syringes",
+        "syringe",
+        "syr",
+        "vials",
+        "vial",
+        "needles",
+        "needle",
+        "cartridges",
+        "cartridge",
+        "powder and solvent",  # specific case for cutoff "suspension" string
+    ],
+    "drops": ["drops", "drop"],
+    "pessary": ["pessaries", "pessary", "pes"],
+    "cream_gel_ointment": [
+        "creams",
+        "cream",
+        "crm",
+        "ointments",
+        "ointment",
+        "oin",
+        "gels",
+        "gel",
+    ],
+    "spray": ["sprays", "spray"],
+}
+# flatten to a lookup of each form variant to its standard form
+form_lookup = {
+    variant: form for form, variants in form_map.items() for variant in variants
+}
+form_pattern = rf"\b(?:{join_regex_alternatives(form_lookup)})"
+
+# --------------------------------------------------------------------------------------
+# POLARS EXPRESSIONS FOR DRUG INFORMATION EXTRACTION
+# --------------------------------------------------------------------------------------
+
+# (expressions extract from `prescription_text_lower`, the lowercased prescription text)
+
+# expression to extract strength text
+extract_strength_expression = (
+    pl.col("prescription_text_lower")
+    # remove P42 to prevent incorrect strength extraction
+    .str.replace_all(r"p42", "").str.extract_all(rf"({strength_pattern})")
+)
+
+# expression to extract strength amounts from each strength text element
+extract_strength_amt_expression = extract_strength_expression.list.eval(
+    pl.element()
+    .str.extract(rf"({number_pattern})", group_index=1)
+    .str.replace_all(r"\s+|,", "")
+    .cast(pl.Float64)
+)
+
+# expression to extract strength units from each strength text element
+extract_strength_unit_expression = extract_strength_expression.list.eval(
+    pl.element().str.extract(rf"({strength_unit_pattern})", group_index=1)
+)
+
+# expression to extract strength amounts from records missing strength units
+extract_tab_cap_strength_amt_expression = (
+    pl.col("prescription_text_lower")
+    .str.extract(rf"(?:(?:tab)|(?:cap)) ({number_pattern})$", group_index=1)
+    .cast(pl.Float64)
+)
+
+# expression to extract drug form
+# (form_pattern is a pure literal alternation, so the regex engine searches for it
+# with a multi-literal prefilter; matched variants have no surrounding whitespace)
+extract_form_expression = (
+    pl.col("prescription_text_lower")
+    .str.extract(rf"({form_pattern})")
+    .replace(form_lookup, default=None)
+    .cast(pl.Categorical)
+)
+
+# expression to extract drug manufacturer/brand information
+manufacturer_info_pattern = r"(?:\(|\[)([^)]*)(?:\)|\])\s*$"
+extract_manufacturer_info_expression = pl.col("prescription_text_lower").str.extract(
+    rf"({manufacturer_info_pattern})", group_index=1
+)
+
+# --------------------------------------------------------------------------------------
+# REGEX PATTERNS FOR QUANTITY INFORMATION EXTRACTION
+# --------------------------------------------------------------------------------------
+
+# generic number pattern (does not allow spaces inside numbers!)
+quantity_number_pattern = r"\d+(?:\.|,)?\d*"  # without accepting spaces in number
+
+# pattern to match forms (e.g. tablets) within quantity text
+quantity_form_pattern = (
+    r"\[?(?:(?:tab(?:let)?)|(?:tbl?\.?)|(?:cap(?:sule)?)|"
+    r"(?:millilitre)|(?:ml)|(?:dose)|(?:unit))\(?s?\)?\]?"
+)
+
+# quantity patterns (pack size and number of packs)
+# (case-insensitive flag included up front so each pattern string is built once and
+# shared by every expression using it)
+quantity_pattern1 = rf"(?i)^\s*\(?({quantity_number_pattern})\)?\s*$"
+quantity_pattern2 = (
+    rf"(?i)^\s*\(?({quantity_number_pattern})"
+    rf"\s*(?:\-|x|\s)?\s*(?:{quantity_form_pattern})\)?"
+)
+quantity_pattern3 = (
+    rf"(?i)^\s*({quantity_number_pattern})"
+    r"\s*(?:(?:\-?\s*packs?\s+of\s+)|(?:\-?\s*o\.?p\s+of\s+)|x|\*|\s|\-)\s*"
+    rf"({quantity_number_pattern})"
+    r"(?:\s*(?:\-|x)?\s*"
+    rf"(?:{quantity_form_pattern}))?"
+)
+quantity_pattern4 = rf"(?i)^\s*x?\s*({quantity_number_pattern})\s*(?:'|\-|<|\[|b|\.|\()"
+
+# pattern to match time units
+time_units = ["day", "week", "month", "year"]
+time_unit_pattern = rf"(?:{join_regex_alternatives(time_units)})s?"
+
+# time supply and unit patterns (case-insensitive, as above)
+time_pattern1 = (
+    rf"(?i)({quantity_number_pattern})\s*(?:\-|x|\s)?\s*({time_unit_pattern})"
+)
+time_pattern2 = rf"(?i)({quantity_number_pattern})\s*/\s*12"
+time_pattern3 = rf"(?i)({quantity_number_pattern})\s*/\s*52"
+time_pattern4 = rf"(?i)\(?({quantity_number_pattern})\s*d\)?"
+time_pattern5 = rf"(?i)number of days\s*=\s*({quantity_number_pattern})"
+
+# --------------------------------------------------------------------------------------
+# POLARS EXPRESSIONS FOR QUANTITY INFORMATION EXTRACTION
+# --------------------------------------------------------------------------------------
+
+# expression to clean quantity_text column
+clean_quantity_text_expression = (
+    pl.col("quantity_text").str.replace_all(strength_pattern, "").str.strip_chars()
+)
+
+# expression to extract pack size as float
+# (`str.extract` returns null when there is no match, so coalescing the extractions
+# selects the first matching pattern without a separate `str.contains` check)
+extract_pack_size_expression = pl.coalesce(
+    [
+        extract_text_from_col("quantity_text", pattern, group_index).cast(pl.Float64)
+        for pattern, group_index in [
+            (quantity_pattern1, 1),
+            (quantity_pattern2, 1),
+            (quantity_pattern3, 2),
+            (quantity_pattern4, 1),
+        ]
+    ]
+)
+
+# expression to extract number of packs as float (1 unless a positive number is found)
+# (the common `extracted_num_packs` subexpression is evaluated once by polars)
+extracted_num_packs = extract_text_from_col("quantity_text", quantity_pattern3).cast(
+    pl.Float64
+)
+extract_num_packs_expression = (
+    pl.when(extracted_num_packs > 0).then(extracted_num_packs).otherwise(1)
+)
+
+# expression to extract time supply as float
+extract_time_supply_expression = pl.coalesce(
+    [
+        extract_text_from_col("quantity_text", pattern)
+        for pattern in [
+            time_pattern1,
+            time_pattern2,
+            time_pattern3,
+            time_pattern4,
+            time_pattern5,
+        ]
+    ]
+).cast(pl.Int64)
+
+# expression to extract or fill time units
+# (re-uses the time supply extractions to detect which pattern matched)
+extract_time_unit_expression = (
+    pl.coalesce(
+        extract_text_from_col("quantity_text", time_pattern1, group_index=2),
+        *[
+            pl.when(extract_text_from_col("quantity_text", pattern).is_not_null())
+            .then(pl.lit(time_unit))
+            .otherwise(None)
+            for pattern, time_unit in [
+                (time_pattern2, "month"),
+                (time_pattern3, "week"),
+                (time_pattern4, "day"),
+                (time_pattern5, "day"),
+            ]
+        ],
+    )
+    .str.to_lowercase()
+    .str.strip_chars_end("s")
+    .cast(pl.Categorical)
+)
+
+# --------------------------------------------------------------------------------------
+# CLEANING FUNCTIONS
+# --------------------------------------------------------------------------------------
+
+
+def load_rx_records(
+    parquet_in: Path, drug_name_remove: Iterable[str] = ()
+) -> pl.LazyFrame:
+    """
+    Load raw prescription records, removing records with prescription text containing
+    any of the `drug_name_remove` substrings (e.g. irrelevant drugs/devices).
+    """
+    rx = pl.scan_parquet(parquet_in).rename(
+        {"drug_name": "prescription_text", "quantity": "quantity_text"}
+    )
+    if drug_name_remove:
+        # (literal substring search)
+        rx = rx.filter(
+            ~pl.col("prescription_text").str.contains_any(
+                list(drug_name_remove), ascii_case_insensitive=True
+            )
+        )
+
+    return rx
+
+
+def create_drugs(generic_to_brand_names_map: Dict[str, List[str]]) -> Dict[str, Drug]:
+    """
+    Create drug objects from a mapping of generic to brand drug names, as a dictionary
+    keyed by generic name. Drug objects are constructed concurrently, as each requests
+    its class from the RxClass API on a cache miss.
+    """
+    items = list(generic_to_brand_names_map.items())
+    if not items:
+        return {}
+
+    # (worker count is capped, as RxClass API requests are rate limited)
+    with ThreadPoolExecutor(max_workers=min(8, len(items))) as executor:
+        drug_list = list(
+            executor.map(
+                lambda item: Drug(generic_name=item[0], brand_names=item[1]), items
+            )
+        )
+
+    return {drug.generic_name: drug for drug in drug_list}
+
+
+def get_brand_to_generic_maps(drugs: Dict[str, Drug]) -> List[Dict[str, str]]:
+    """
+    Get mappings of brand to generic drug names for standardisation. Brand names of
+    combination drugs (e.g. inegy) map to multiple generic names (ordered as in
+    `combination_drug_generic_names`), so the mapping is split into multiple mappings
+    of scalar values.
+    """
+    brand_to_generic_map = {}
+    for drug in drugs.values():
+        for brand_name in drug.brand_names:
+            if brand_name not in brand_to_generic_map:
+                brand_to_generic_map[brand_name] = []
+            brand_to_generic_map[brand_name].append(drug.generic_name)
+
+    # order generic names of combination drugs as their strengths appear in
+    # prescription text, so strengths are paired with generic names by position
+    for brand_name, generic_names in brand_to_generic_map.items():
+        if brand_name in combination_drug_generic_names:
+            generic_names_order = combination_drug_generic_names[brand_name]
+            generic_names.sort(
+                key=lambda generic_name: (
+                    generic_names_order.index(generic_name)
+                    if generic_name in generic_names_order
+                    else len(generic_names_order)
+                )
+            )
+
+    return [
+        {
+            brand_name: generic_names[i]
+            for brand_name, generic_names in brand_to_generic_map.items()
+            if i < len(generic_names)
+        }
+        for i in range(max(map(len, brand_to_generic_map.values()), default=0))
+    ]
+
+
+def extract_drug_info(
+    rx: pl.LazyFrame,
+    drugs: Dict[str, Drug],
+    generic_names_remove: Iterable[str] = (),
+) -> pl.LazyFrame:
+    """
+    Extract drug information (generic/brand names, class, strength, form, and
+    manufacturer) from prescription text, with one row per drug. Records of drugs in
+    `generic_names_remove` (e.g. the non statin drug of a combination drug) are
+    removed.
+    """
+    generic_names_remove = list(generic_names_remove)
+
+    # expression to extract generic and brand drug names in a single regex pass
+    generic_names = set([drug.generic_name for drug in drugs.values()])
+    brand_names = set(
+        [brand_name for drug in drugs.values() for brand_name in drug.brand_names]
+    )
+    extract_drug_names_expression = pl.col("prescription_text_lower").str.extract_all(
+        rf"({join_regex_alternatives(generic_names | brand_names)})"
+    )
+
+    # expression to select generic drug names from extracted drug names
+    extract_generic_name_expression = pl.col("drug_names").list.eval(
+        pl.element().filter(pl.element().is_in(list(generic_names)))
+    )
+
+    # expression to select brand drug names from extracted drug names
+    extract_brand_name_expression = (
+        pl.col("drug_names")
+        .list.eval(pl.element().filter(pl.element().is_in(list(brand_names))))
+        .flatten()  # assuming no records with > 1 brand name
+    )
+
+    # expression to map brand names to generic names
+    brand_to_generic_maps = get_brand_to_generic_maps(drugs)
+    generic_names_from_brand_name = [
+        pl.col("brand_name").replace(brand_to_generic_map, default=None)
+        for brand_to_generic_map in brand_to_generic_maps
+    ]
+
+    # expression to extract drug class information
+    atc_class_code_map = {
+        generic_name: drug.atc_class_code for generic_name, drug in drugs.items()
+    }
+    atc_class_name_map = {
+        generic_name: drug.atc_class_name for generic_name, drug in drugs.items()
+    }
+    extract_atc_class_code_expression = pl.col("generic_name").list.eval(
+        pl.element().replace(atc_class_code_map, default=None)
+    )
+    extract_atc_class_name_expression = pl.col("generic_name").list.eval(
+        pl.element().replace(atc_class_name_map, default=None)
+    )
+
+    # extract drug information once per unique prescription text, as prescription
+    # texts are heavily repeated across records
+    prescriptions = (
+        rx.select("prescription_text")
+        .unique()
+        # lowercase prescription text once, for use by all extraction expressions
+        .with_columns(
+            prescription_text_lower=pl.col("prescription_text").str.to_lowercase()
+        )
+        .with_columns(drug_names=extract_drug_names_expression)
+        .with_columns(
+            generic_name=extract_generic_name_expression,
+            brand_name=extract_brand_name_expression,
+            strength_text=extract_strength_expression,
+            strength_amt=extract_strength_amt_expression,
+            strength_unit=extract_strength_unit_expression,
+            form=extract_form_expression,
+            manufacturer_info=extract_manufacturer_info_expression,
+        )
+        .drop("drug_names")
+        # concatenate generic names with generic names mapped from brand names
+        # (keeping order, as strengths are paired with generic names by position)
+        .with_columns(
+            generic_name=pl.concat_list(
+                ["generic_name", *generic_names_from_brand_name]
+            )
+            .list.drop_nulls()
+            .list.unique(maintain_order=True),
+        )
+        # extract strength amounts from records missing strength units (e.g. "tab 40")
+        .with_columns(tab_cap_strength_amt=extract_tab_cap_strength_amt_expression)
+        .with_columns(
+            # handle instances of missing strength units
+            strength_amt=pl.when(pl.col("tab_cap_strength_amt").is_not_null())
+            .then(pl.col("tab_cap_strength_amt"))
+            .otherwise(pl.col("strength_amt")),
+            strength_unit=pl.when(pl.col("tab_cap_strength_amt").is_not_null())
+            .then(pl.lit("mg"))
+            .otherwise(pl.col("strength_unit")),
+            # assume tablet form for all records missing form
+            form=pl.when(pl.col("form").is_null())
+            .then(pl.lit("tablet"))
+            .otherwise(pl.col("form")),
+        )
+        .drop("tab_cap_strength_amt", "prescription_text_lower")
+        .with_columns(
+            # handle instances of duplicate strength
+            strength_amt=pl.when(pl.col("prescription_text") == "SIMVASTATIN 40MG 40MG")
+            .then(pl.lit(40))
+            .otherwise(pl.col("strength_amt")),
+            strength_unit=pl.when(
+                pl.col("prescription_text") == "SIMVASTATIN 40MG 40MG"
+            )
+            .then(pl.lit("mg"))
+            .otherwise(pl.col("strength_unit")),
+        )
+        .drop("strength_text")
+        # remove records without any relevant drug names before flattening lists
+        .filter(
+            pl.col("generic_name")
+            .list.eval(~pl.element().is_in(generic_names_remove))
+            .list.any()
+        )
+        # add class columns
+        .with_columns(
+            atc_class_code=extract_atc_class_code_expression,
+            atc_class_name=extract_atc_class_name_expression,
+        )
+    )
+
+    # flatten extracted list columns to one row per drug, taking the first element of
+    # records with at most one extracted value per column (the vast majority) and only
+    # exploding records with multiple extracted values
+    drug_info_list_cols = [
+        "generic_name",
+        "atc_class_code",
+        "atc_class_name",
+        "strength_amt",
+        "strength_unit",
+    ]
+    has_single_drug_info = pl.all_horizontal(
+        [pl.col(col).list.len().fill_null(0) <= 1 for col in drug_info_list_cols]
+    )
+    prescriptions = pl.concat(
+        [
+            prescriptions.filter(has_single_drug_info).with_columns(
+                pl.col(drug_info_list_cols).list.first()
+            ),
+            # (removed drugs of combination drug records are removed after exploding,
+            # as strengths are paired with generic names by position)
+            prescriptions.filter(~has_single_drug_info)
+            .explode(drug_info_list_cols)
+            .filter(~pl.col("generic_name").is_in(generic_names_remove)),
+        ]
+    )
+
+    # standardise strength units and convert to categorical dtype
+    prescriptions = prescriptions.with_columns(
+        strength_unit=pl.col("strength_unit")
+        .str.strip_chars()
+        .str.to_lowercase()
+        # standardise numerator and denominator units separately (e.g. "mgs/ml")
+        .str.split("/")
+        .list.eval(pl.element().replace(strength_unit_lookup))
+        .list.join("/")
+        .cast(pl.Categorical)
+    )
+
+    # join extracted drug information to prescription records (records without
+    # relevant drug names are removed and records of combination drugs are duplicated
+    # per drug)
+    rx = rx.join(prescriptions, on="prescription_text", how="inner")
+
+    return rx
+
+
+def extract_quantity_info(rx: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Extract quantity information (pack size, number of packs, quantity, and time
+    supply) from quantity text.
+    """
+    # extract quantity information once per unique quantity text
+    quantities = (
+        rx.select("quantity_text")
+        .unique()
+        .with_columns(
+            quantity_text_original=pl.col("quantity_text"),
+            quantity_text=clean_quantity_text_expression,
+        )
+        .with_columns(
+            pack_size=extract_pack_size_expression,
+            num_packs=extract_num_packs_expression,
+            time_supply=extract_time_supply_expression,
+            time_unit=extract_time_unit_expression,
+        )
+        # set num_packs to 1 where pack_size = num_packs
+        # (e.g. "60 60 TABLETS" should be 60 tablets, not 60 x 60 = 3600)
+        .with_columns(
+            num_packs=pl.when(
+                (pl.col("pack_size") == pl.col("num_packs"))
+                & (pl.col("pack_size") != 1)
+                & (pl.col("pack_size") != 0)
+                & (pl.col("pack_size").is_not_null())
+            )
+            .then(1)
+            .otherwise(pl.col("num_packs"))
+        )
+        .with_columns(
+            # calculate final quantity from number of packs and pack size
+            quantity=pl.col("pack_size") * pl.col("num_packs"),
+            # clean time supply column into polars duration dtype
+            time_supply=pl.when(pl.col("time_unit") == "day")
+            .then(pl.duration(days=pl.col("time_supply")))
+            .when(pl.col("time_unit") == "week")
+            .then(pl.duration(weeks=pl.col("time_supply")))
+            .when(pl.col("time_unit") == "month")
+            .then(pl.duration(days=30 * pl.col("time_supply")))
+            .when(pl.col("time_unit") == "year")
+            .then(pl.duration(days=365 * pl.col("time_supply")))
+            .otherwise(None),
+        )
+        .with_columns(quantity_text=pl.col("quantity_text_original"))
+        .drop("quantity_text_original")
+        # remove redundant time supply unit column
+        .drop("time_unit")
+    )
+
+    # join extracted quantity information to prescription records
+    rx = rx.join(quantities, on="quantity_text", how="left", join_nulls=True)
+
+    return rx
+
+
+def clean_rx_records(
+    parquet_in: Path,
+    parquet_out: Path,
+    generic_to_brand_names_map: Dict[str, List[str]],
+    other_generic_to_brand_names_map: Dict[str, List[str]] | None = None,
+    drug_name_remove: Iterable[str] = (),
+) -> pl.DataFrame:
+    """
+    Clean raw prescription records, extracting drug and quantity information from
+    prescription and quantity text, and write to a local parquet file. Drugs in
+    `other_generic_to_brand_names_map` are identified (e.g. the non statin drug of a
+    combination drug) but their records are removed.
+    """
+    if other_generic_to_brand_names_map is None:
+        other_generic_to_brand_names_map = {}
+
+    drugs = create_drugs(generic_to_brand_names_map | other_generic_to_brand_names_map)
+
+    rx = (
+        load_rx_records(parquet_in, drug_name_remove)
+        .pipe(extract_drug_info, drugs, other_generic_to_brand_names_map.keys())
+        .pipe(extract_quantity_info)
+    )
+
+    # collect cleaned records once, for both printing and writing to file
+    rx = rx.collect()
+    print(rx)
+
+    rx.write_parquet(parquet_out)
+
+    return rx
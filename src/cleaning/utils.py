@@ -1,8 +1,73 @@
+import functools
+import json
+import threading
 from dataclasses import dataclass
+from pathlib import Path
 from typing import Iterable
 
 import polars as pl
 import requests
+from requests.adapters import HTTPAdapter
+
+# on-disk cache of RxClass API results, to avoid repeating requests across runs
+RXCLASS_CACHE_FILE = Path(__file__).resolve().parents[2] / "data" / "rxclass_cache.json"
+
+# shared session for connection reuse across RxClass API requests
+_rxclass_session = requests.Session()
+_rxclass_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=16))
+_rxclass_cache_lock = threading.Lock()
+
+
+def _load_rxclass_cache() -> dict:
+    if RXCLASS_CACHE_FILE.exists():
+        # (ignore missing results persisted by earlier versions, so they are retried)
+        cache = json.loads(RXCLASS_CACHE_FILE.read_text())
+        return {key: value for key, value in cache.items() if value is not None}
+    return {}
+
+
+_rxclass_cache = _load_rxclass_cache()
+
+
+@functools.lru_cache(maxsize=None)
+def find_rxcui_and_class_using_rxclass_api(
+    generic_name: str, source: str = "ATC", relationships: str = "ALL"
+) -> dict | None:
+    """
+    Find the RxCUI and drug class of a generic drug name using the RxClass API.
+    Results are memoised in memory and successful lookups are persisted to
+    `RXCLASS_CACHE_FILE` (delete the file to refresh cached results).
+    """
+    cache_key = f"{generic_name}|{source}|{relationships}"
+    if cache_key in _rxclass_cache:
+        return _rxclass_cache[cache_key]
+
+    service_domain = "https://rxnav.nlm.nih.gov"
+    request_string = (
+        f"{service_domain}/REST/rxclass/class/byDrugName.json?"
+        f"drugName={generic_name}&relaSource={source}&relas={relationships}"
+    )
+    response = _rxclass_session.get(request_string).json()
+
+    rxclass_results = None
+    for result in response["rxclassDrugInfoList"]["rxclassDrugInfo"]:
+        if result["minConcept"]["name"] == generic_name:
+            rxclass_results = {
+                "rxcui": result["minConcept"]["rxcui"],
+                "atc_class_code": result["rxclassMinConceptItem"]["classId"],
+                "atc_class_name": result["rxclassMinConceptItem"]["className"],
+            }
+            break
+
+    # (only successful lookups are persisted, so missing results are retried on the
+    # next run rather than cached for good)
+    if rxclass_results is not None:
+        with _rxclass_cache_lock:
+            _rxclass_cache[cache_key] = rxclass_results
+            RXCLASS_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            RXCLASS_CACHE_FILE.write_text(json.dumps(_rxclass_cache, indent=4) + "\n")
+
+    return rxclass_results
 
 
 @dataclass
@@ -26,21 +91,9 @@ class Drug:
     def _find_rxcui_and_class_using_rxclass_api(
         self, source: str = "ATC", relationships: str = "ALL"
     ):
-        service_domain = "https://rxnav.nlm.nih.gov"
-        request_string = (
-            f"{service_domain}/REST/rxclass/class/byDrugName.json?"
-            f"drugName={self.generic_name}&relaSource={source}&relas={relationships}"
+        return find_rxcui_and_class_using_rxclass_api(
+            self.generic_name, source, relationships
         )
-        response = requests.get(request_string).json()
-
-        for result in response["rxclassDrugInfoList"]["rxclassDrugInfo"]:
-            if result["minConcept"]["name"] == self.generic_name:
-                return {
-                    "rxcui": result["minConcept"]["rxcui"],
-                    "atc_class_code": result["rxclassMinConceptItem"]["classId"],
-                    "atc_class_name": result["rxclassMinConceptItem"]["className"],
-                }
-        return None
 
 
 def get_polars_col(col: str | pl.Series) -> pl.Series:
@@ -50,9 +103,20 @@ def get_polars_col(col: str | pl.Series) -> pl.Series:
 
 
 def add_ignore_case_flag_to_regex(pattern: str) -> str:
+    if pattern.startswith(r"(?i)"):
+        return pattern
     return r"(?i)" + pattern
 
 
+def join_regex_alternatives(patterns: Iterable[str]) -> str:
+    """
+    Join patterns into a regex alternation, deduplicated and sorted by descending
+    length so that longer alternatives (e.g. "milligram") are tried before their
+    prefixes (e.g. "mg", "g").
+    """
+    return "|".join(sorted(set(patterns), key=lambda pattern: (-len(pattern), pattern)))
+
+
 def check_col_contains(
     col: str | pl.Series, pattern: str, ignore_case: bool = True
 ) -> pl.Expr:
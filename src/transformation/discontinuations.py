@@ -5,12 +5,36 @@ from typing import Tuple, List
 import polars as pl
 from durations import calculate_rx_duration
 
+# expression to get the first issue date of each drug per eid (independent of order)
+first_issue_date_expression = pl.col("issue_date").min().over("eid", "generic_name")
+
+
+def get_date_threshold_expression(missed_rx_count: int = 4) -> pl.Expr:
+    """Get Polars expression for `date_threshold` (see `calculate_date_threshold`)."""
+    return pl.col("issue_date") + (
+        pl.col("expected_rx_duration") * missed_rx_count
+    ).cast(pl.Duration("ms"))
+
 
 def get_drugs_first_issue_date_for_eid(rx: pl.LazyFrame) -> pl.LazyFrame:
-    """"""
-    return rx.with_columns(
-        first_issue_date=pl.col("issue_date").first().over("eid", "generic_name")
-    )
+    """Get the earliest issue date of each drug per `eid`, as `first_issue_date`."""
+    return rx.with_columns(first_issue_date=first_issue_date_expression)
+
+
+def calculate_date_threshold(
+    rx: pl.LazyFrame, missed_rx_count: int = 4
+) -> pl.LazyFrame:
+    """
+    Calculate the date by which the next prescription must be issued for treatment to
+    be considered continuous, as `missed_rx_count` expected prescription durations
+    after the issue date.
+    """
+    if "expected_rx_duration" not in rx.columns:
+        rx = rx.pipe(calculate_rx_duration)
+
+    rx = rx.with_columns(date_threshold=get_date_threshold_expression(missed_rx_count))
+
+    return rx
 
 
 def identify_discontinuations(
@@ -19,29 +43,27 @@ def identify_discontinuations(
     missed_rx_count: int = 4,
 ) -> pl.LazyFrame:
     """Identify and label instances of discontinuations from prescription records."""
-    if "expected_rx_duration" not in rx.columns:
-        rx = rx.pipe(calculate_rx_duration)
-
-    # define polars expression for the date threshold to determine discontinuations
-    discontinuation_date_threshold = pl.col("issue_date") + (
-        pl.col("expected_rx_duration") * missed_rx_count
-    ).cast(pl.Duration("ms"))
+    if "date_threshold" not in rx.columns:
+        rx = rx.pipe(calculate_date_threshold, missed_rx_count)
 
     # define polars expression for discontinuation logic
+    # (`max_global_rx_issue_date` is the latest issue date across all eids, baked into
+    # the plan as a literal; the `min/max_global_rx_issue_date` columns are per eid, as
+    # prescription data coverage differs between participants, so remain columns)
     discontinued = (
         (
             pl.col("next_issue_date").is_null()
             | (
-                (pl.col("next_issue_date") > discontinuation_date_threshold)
+                (pl.col("next_issue_date") > pl.col("date_threshold"))
                 & (pl.col("issue_date") != pl.col("next_issue_date"))
             )
         )
         & (
             pl.col("date_of_death").is_null()
-            | (pl.col("date_of_death") > discontinuation_date_threshold)
+            | (pl.col("date_of_death") > pl.col("date_threshold"))
         )
-        & (pl.col("max_global_rx_issue_date") >= discontinuation_date_threshold)
-        & (pl.col("expected_rx_end_date") < max_global_rx_issue_date)
+        & (pl.col("max_global_rx_issue_date") >= pl.col("date_threshold"))
+        & (pl.col("expected_rx_end_date") < pl.lit(max_global_rx_issue_date))
         & (
             pl.col("first_issue_date")
             >= (pl.col("min_global_rx_issue_date") + pl.duration(days=365))
@@ -57,16 +79,11 @@ def identify_discontinuations(
     )
 
     # apply polars expressions
-    rx = (
-        rx.sort("eid", "issue_date")
-        .with_row_index()
-        .with_columns(
-            discontinued=discontinued,
-            discontinuation_date=pl.when(discontinued)
-            .then(pl.col("expected_rx_end_date"))
-            .otherwise(None),
-        )
-        .drop("index")
+    rx = rx.with_columns(
+        discontinued=discontinued,
+        discontinuation_date=pl.when(discontinued)
+        .then(pl.col("expected_rx_end_date"))
+        .otherwise(None),
     )
 
     return rx
@@ -122,38 +139,31 @@ def generate_sample_size_summary(
             str(out_path.stem) + "_" + "_".join(drugs_to_include) + ".csv"
         )
     elif drugs_to_exclude:
-        drugs_to_include = [
-            drug
-            for drug in (
-                discontinuations.select("generic_name")
-                .unique()
-                .collect()
-                .to_series()
-                .to_list()
-            )
-            if drug not in drugs_to_exclude
-        ]
         discontinuations = discontinuations.filter(
-            pl.col("generic_name").is_in(drugs_to_include)
+            ~pl.col("generic_name").is_in(drugs_to_exclude)
         )
         out_path: Path = out_path.parent / str(
             str(out_path.stem) + "_not_" + "_".join(drugs_to_exclude) + ".csv"
         )
 
+    # count discontinuations and restarts per eid once, for reuse across all groups
+    eid_counts = discontinuations.group_by("eid").agg(
+        eid_discontinued_count=pl.col("discontinued").sum(),
+        eid_restarted_count=pl.col("restarted").sum(),
+    )
+    is_real_stopper = (pl.col("eid_discontinued_count") == 1) & (
+        pl.col("eid_restarted_count") == 0
+    )
+
     summary = (
         discontinuations.sort("eid", "issue_date")
-        .with_row_index()
-        .with_columns(
-            rx_count=(pl.col("index") - pl.col("index").first() + 1).over("eid"),
-        )
+        .with_columns(rx_count=(pl.int_range(pl.len()) + 1).over("eid"))
+        .join(eid_counts, on="eid", how="left")
         .select(
             [
                 (
                     pl.col("eid")
-                    .filter(
-                        (pl.col("discontinued").sum().over("eid") == 1)
-                        & (pl.col("restarted").sum().over("eid") == 0)
-                    )
+                    .filter(is_real_stopper)
                     .unique()
                     .count()
                     .alias("Real Stoppers")
@@ -161,8 +171,7 @@ def generate_sample_size_summary(
                 (
                     pl.col("eid")
                     .filter(
-                        (pl.col("discontinued").sum().over("eid") == 1)
-                        & (pl.col("restarted").sum().over("eid") == 0)
+                        is_real_stopper
                         & pl.col("discontinued")
                         & (
                             pl.col("issue_date") - pl.col("first_issue_date")
@@ -177,10 +186,7 @@ def generate_sample_size_summary(
             + [
                 pl.col("eid")
                 .filter(
-                    (pl.col("discontinued").sum().over("eid") == 1)
-                    & (pl.col("restarted").sum().over("eid") == 0)
-                    & pl.col("discontinued")
-                    & (pl.col("rx_count") == i)
+                    is_real_stopper & pl.col("discontinued") & (pl.col("rx_count") == i)
                 )
                 .unique()
                 .count()
@@ -214,15 +220,20 @@ def generate_sample_size_summary(
         )
         .collect()
         .transpose(include_header=True, header_name="Group", column_names=["Count"])
-        .with_columns(
-            (pl.col("Count") / (pl.col("Count").tail(1)))
-            .round(2)
-            .alias("Count / Total Statin Users"),
-            pl.when(pl.col("Group") != "Total Statin Users")
-            .then((pl.col("Count") / (pl.col("Count").tail(2).head(1))).round(2))
-            .otherwise(None)
-            .alias("Count / Total Discontinuers"),
-        )
+    )
+
+    # add group counts as proportions of the total statin users/discontinuers (the last
+    # two groups)
+    total_statin_users = summary[-1, "Count"]
+    total_discontinuers = summary[-2, "Count"]
+    summary = summary.with_columns(
+        (pl.col("Count") / total_statin_users)
+        .round(2)
+        .alias("Count / Total Statin Users"),
+        pl.when(pl.col("Group") != "Total Statin Users")
+        .then((pl.col("Count") / total_discontinuers).round(2))
+        .otherwise(None)
+        .alias("Count / Total Discontinuers"),
     )
 
     print(f"Writing discontinuation sample size summary to {out_path}...", end=" ")
@@ -238,10 +249,19 @@ def discontinuation_pipeline(
     max_global_rx_issue_date: date | datetime,
     missed_rx_count: int = 4,
 ) -> pl.LazyFrame:
+    if "expected_rx_duration" not in rx.columns:
+        rx = rx.pipe(calculate_rx_duration)
+
     rx = (
-        rx.pipe(get_drugs_first_issue_date_for_eid)
+        rx.sort("eid", "issue_date")
+        # compute columns used by the discontinuation logic in a single pass
+        .with_columns(
+            date_threshold=get_date_threshold_expression(missed_rx_count),
+            first_issue_date=first_issue_date_expression,
+        )
         .pipe(identify_discontinuations, max_global_rx_issue_date, missed_rx_count)
         .pipe(count_discontinuations)
         .pipe(identify_restarts)
+        .drop("date_threshold")
     )
     return rx
@@ -76,7 +76,8 @@ def smooth_dosage(
 ) -> pl.LazyFrame:
     """
     Apply a rolling average (mean or median) to the `dosage_per_day` column, grouped
-    over `eid`s.
+    over `eid`s. Missing values and windows truncated at the start/end of each `eid`'s
+    records are averaged over the available values, rather than giving nulls.
     """
     if "dosage_per_day" not in rx.columns:
         rx = rx.pipe(calculate_dosage)
@@ -86,13 +87,13 @@ def smooth_dosage(
     if use_median:
         rx = rx.with_columns(
             dosage_per_day_smoothed=pl.col("dosage_per_day")
-            .rolling_median(window_size=window_size, center=True)
+            .rolling_median(window_size=window_size, min_periods=1, center=True)
             .over("eid")
         )
     else:
         rx = rx.with_columns(
             dosage_per_day_smoothed=pl.col("dosage_per_day")
-            .rolling_mean(window_size=window_size, center=True)
+            .rolling_mean(window_size=window_size, min_periods=1, center=True)
             .over("eid")
         )
 
@@ -124,39 +125,26 @@ def calculate_volume_prescribed(rx: pl.LazyFrame) -> pl.LazyFrame:
     return rx
 
 
+# expressions for the number of days until the next prescription and the expected
+# prescription duration in days, shared by the per day quantity/dosage calculations
+issue_date_diff_days_expression = (
+    pl.col("next_issue_date") - pl.col("issue_date")
+).dt.total_days()
+expected_rx_duration_days_expression = pl.col("expected_rx_duration").dt.total_days()
+
+
 def calculate_quantity_per_day(rx: pl.LazyFrame, round: bool = False) -> pl.LazyFrame:
+    quantity_per_day = (
+        pl.when(pl.col("time_supply").is_not_null())
+        .then(None)
+        .when(pl.col("next_issue_date").is_not_null() & ~pl.col("discontinued"))
+        .then(pl.col("quantity") / issue_date_diff_days_expression)
+        .otherwise(pl.col("quantity") / expected_rx_duration_days_expression)
+    )
     if round:
-        rx = rx.with_columns(
-            quantity_per_day=pl.when(pl.col("time_supply").is_not_null())
-            .then(None)
-            .when(pl.col("next_issue_date").is_not_null() & ~pl.col("discontinued"))
-            .then(
-                (
-                    pl.col("quantity")
-                    / (pl.col("next_issue_date") - pl.col("issue_date")).dt.total_days()
-                ).round()
-            )
-            .otherwise(
-                (
-                    pl.col("quantity") / pl.col("expected_rx_duration").dt.total_days()
-                ).round()
-            )
-        )
-    else:
-        rx = rx.with_columns(
-            quantity_per_day=pl.when(pl.col("time_supply").is_not_null())
-            .then(None)
-            .when(pl.col("next_issue_date").is_not_null() & ~pl.col("discontinued"))
-            .then(
-                (
-                    pl.col("quantity")
-                    / (pl.col("next_issue_date") - pl.col("issue_date")).dt.total_days()
-                )
-            )
-            .otherwise(
-                (pl.col("quantity") / pl.col("expected_rx_duration").dt.total_days())
-            )
-        )
+        quantity_per_day = quantity_per_day.round()
+
+    rx = rx.with_columns(quantity_per_day=quantity_per_day)
     return rx
 
 
@@ -165,15 +153,8 @@ def calculate_dosage_per_day(rx: pl.LazyFrame) -> pl.LazyFrame:
         pl.when(pl.col("time_supply").is_not_null())
         .then(None)
         .when(pl.col("next_issue_date").is_not_null() & ~pl.col("discontinued"))
-        .then(
-            (
-                pl.col("volume_prescribed")
-                / (pl.col("next_issue_date") - pl.col("issue_date")).dt.total_days()
-            )
-        )
-        .otherwise(
-            (pl.col("quantity") / pl.col("expected_rx_duration").dt.total_days())
-        )
+        .then(pl.col("volume_prescribed") / issue_date_diff_days_expression)
+        .otherwise(pl.col("quantity") / expected_rx_duration_days_expression)
         .alias("dosage_per_day")
     )
     return rx
@@ -188,28 +169,24 @@ def discretise_dosage(
     Maps floats stored in `dosage` column to their nearest value in the
     `discrete_dosages` list.
     """
-    rx = (
-        rx.with_columns(
-            pl.concat_list(
-                [
-                    (pl.col("dosage_per_day") - v).abs().alias(f"{i}_discrete")
-                    for i, v in enumerate(discrete_dosages)
-                ]
-            )
-            .list.arg_min()
-            .alias("min_diff_index"),
-            pl.lit(discrete_dosages).alias("discrete_dosages"),
-        )
-        .with_columns(
-            pl.when(
-                (pl.col("dosage_per_day") > 0)
-                & (pl.col("dosage_per_day") < upper_limit)
-            )
-            .then(pl.col("discrete_dosages").list.get(pl.col("min_diff_index")))
-            .otherwise(None)
-            .alias("discrete_dosage_per_day")
+    # bin dosages by the midpoints between consecutive discrete dosages (bins are
+    # right-closed, so ties are mapped to the lower discrete dosage)
+    discrete_dosages = sorted(discrete_dosages)
+    midpoints = [(a + b) / 2 for a, b in zip(discrete_dosages, discrete_dosages[1:])]
+    nearest_discrete_dosage = (
+        pl.col("dosage_per_day")
+        .cut(breaks=midpoints, labels=[str(v) for v in discrete_dosages])
+        .cast(pl.Utf8)
+        .cast(pl.Int64)
+    )
+
+    rx = rx.with_columns(
+        pl.when(
+            (pl.col("dosage_per_day") > 0) & (pl.col("dosage_per_day") < upper_limit)
         )
-        .drop("min_diff_index", "discrete_dosages")
+        .then(nearest_discrete_dosage)
+        .otherwise(None)
+        .alias("discrete_dosage_per_day")
     )
     return rx
 
@@ -224,29 +201,52 @@ def map_discrete_dosage_to_intensity(
         "rosuvastatin": (None, (5), (10, 20, 40)),
     },
 ) -> pl.LazyFrame:
-    # Create dataframe from intensity dictionary
-    rows = []
+    # Create (drug, dosage) to intensity lookup dataframe from intensity dictionary
+    # (intensities are 1, 2, 3 for low, medium, high; single dosages may be given as
+    # scalars instead of tuples)
+    rows = {}
     for generic_name, ranges in intensity_ranges.items():
-        row = {"generic_name": generic_name}
-        for i, intensity in enumerate(["low", "medium", "high"]):
-            row[intensity] = ranges[i] if i < len(ranges) else None
-        rows.append(row)
-    intensity = pl.DataFrame(rows)
-
-    # Join intensity dataframe to prescription records
-    rx = rx.join(intensity, on="generic_name", how="left")
-
-    # Map dosage values to intensity categories
-    rx = rx.with_columns(
-        pl.when(pl.col("low").list.contains(pl.col("discrete_dosage_per_day")))
-        .then(1)
-        .when(pl.col("medium").list.contains(pl.col("discrete_dosage_per_day")))
-        .then(2)
-        .when(pl.col("high").list.contains(pl.col("discrete_dosage_per_day")))
-        .then(3)
-        .otherwise(None)
-        .alias("dosage_intensity")
-    ).drop("low", "medium", "high")
+        for i, dosages in enumerate(ranges[:3]):
+            if dosages is None:
+                continue
+            if not isinstance(dosages, tuple):
+                dosages = (dosages,)
+            for dosage in dosages:
+                # (each (drug, dosage) must map to a single intensity, so the join
+                # below does not duplicate prescription records)
+                if (generic_name, dosage) in rows:
+                    raise ValueError(
+                        f"{generic_name} dosage {dosage} is listed more than once in "
+                        "intensity_ranges"
+                    )
+                rows[(generic_name, dosage)] = {
+                    "generic_name": generic_name,
+                    "discrete_dosage_per_day": dosage,
+                    "dosage_intensity": i + 1,
+                }
+    intensity = pl.DataFrame(
+        list(rows.values()),
+        schema={
+            "generic_name": pl.Utf8,
+            "discrete_dosage_per_day": pl.Int64,
+            "dosage_intensity": pl.Int32,
+        },
+    ).lazy()
+    # (match the generic name dtype of the prescription records, e.g. categorical,
+    # dropping drugs that cannot be cast, e.g. drugs missing from an enum of the
+    # records' generic names)
+    intensity = intensity.with_columns(
+        pl.col("generic_name").cast(rx.schema["generic_name"], strict=False)
+    ).drop_nulls("generic_name")
+
+    # Join intensity lookup dataframe to prescription records to map dosage values to
+    # intensity categories
+    rx = rx.join(
+        intensity,
+        on=["generic_name", "discrete_dosage_per_day"],
+        how="left",
+        validate="m:1",
+    )
 
     return rx
 
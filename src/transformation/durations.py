@@ -42,19 +42,14 @@ def calculate_median_rx_issue_date_difference_per_eid(
         "quantity",
     ]
 
-    rx = (
-        rx.sort("eid", "issue_date")
-        .group_by(group_by_cols)
-        .agg(
-            "*",
-            median_issue_date_diff_per_eid=pl.col("issue_date_diff")
-            .filter(
-                pl.col("next_issue_date").is_not_null()
-                & (pl.col("issue_date_diff") < date_diff_cutoff)
-            )
-            .median(),
+    rx = rx.with_columns(
+        median_issue_date_diff_per_eid=pl.col("issue_date_diff")
+        .filter(
+            pl.col("next_issue_date").is_not_null()
+            & (pl.col("issue_date_diff") < date_diff_cutoff)
         )
-        .explode(pl.exclude(group_by_cols, "median_issue_date_diff_per_eid"))
+        .median()
+        .over(group_by_cols)
     )
 
     return rx
@@ -79,15 +74,11 @@ def calculate_mean_rx_issue_date_difference(
         "quantity",
     ]
 
-    rx = (
-        rx.group_by(group_by_cols)
-        .agg(
-            "*",
-            mean_issue_date_diff=pl.col("median_issue_date_diff_per_eid").mean(),
-        )
-        .explode(pl.exclude(group_by_cols, "mean_issue_date_diff"))
-        .drop("median_issue_date_diff_per_eid")
-    )
+    rx = rx.with_columns(
+        mean_issue_date_diff=pl.col("median_issue_date_diff_per_eid")
+        .mean()
+        .over(group_by_cols)
+    ).drop("median_issue_date_diff_per_eid")
 
     return rx
 
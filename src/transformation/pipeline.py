@@ -1,5 +1,7 @@
 import argparse
+import os
 from pathlib import Path
+from typing import Callable
 
 import polars as pl
 from discontinuations import discontinuation_pipeline, generate_sample_size_summary
@@ -8,40 +10,99 @@ from durations import calculate_rx_end_date
 from switches import identify_switches
 from rx_summary import generate_eid_rx_summary
 
+# columns of transformed prescription records
+FINAL_COLUMNS = [
+    "eid",
+    "generic_name",
+    "brand_name",
+    "manufacturer_info",
+    "atc_class_code",
+    "atc_class_name",
+    "form",
+    "strength_amt",
+    "strength_unit",
+    "quantity",
+    "num_packs",
+    "pack_size",
+    "time_supply",
+    "volume_prescribed",
+    "quantity_per_day",
+    "dosage_per_day",
+    "discrete_dosage_per_day",
+    "dosage_intensity",
+    "issue_date",
+    "expected_rx_duration",
+    "expected_rx_end_date",
+    "first_issue_date",
+    "discontinued",
+    "discontinuation_date",
+    "discontinuation_count",
+    "restarted",
+    "is_switch",
+    "switch_to_drug",
+]
 
-def select_columns(rx: pl.DataFrame) -> pl.DataFrame:
-    return rx.select(
-        [
-            "eid",
-            "generic_name",
-            "brand_name",
-            "manufacturer_info",
-            "atc_class_code",
-            "atc_class_name",
-            "form",
-            "strength_amt",
-            "strength_unit",
-            "quantity",
-            "num_packs",
-            "pack_size",
-            "time_supply",
-            "volume_prescribed",
-            "quantity_per_day",
-            "dosage_per_day",
-            "discrete_dosage_per_day",
-            "dosage_intensity",
-            "issue_date",
-            "expected_rx_duration",
-            "expected_rx_end_date",
-            "first_issue_date",
-            "discontinued",
-            "discontinuation_date",
-            "discontinuation_count",
-            "restarted",
-            "is_switch",
-            "switch_to_drug",
-        ]
+# columns of cleaned prescription records used by the transformation pipeline
+RX_RECORDS_COLUMNS = [
+    "eid",
+    "generic_name",
+    "brand_name",
+    "manufacturer_info",
+    "atc_class_code",
+    "atc_class_name",
+    "form",
+    "strength_amt",
+    "strength_unit",
+    "quantity",
+    "num_packs",
+    "pack_size",
+    "time_supply",
+    "issue_date",
+]
+
+
+def select_columns(rx: pl.LazyFrame) -> pl.LazyFrame:
+    return rx.select(FINAL_COLUMNS)
+
+
+def encode_generic_names(rx: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Encode generic names as categorical, so windows/joins over them hash integer codes.
+    Categories are taken from the records as the plan runs (so the plan stays lazy,
+    and unexpected names such as ezetimibe in cleaned ldl lowering drug records never
+    fail to cast); enable the global string cache so joins with other categorical
+    generic names (e.g. the dosage intensity lookup) do not re-encode them.
+    """
+    return rx.with_columns(pl.col("generic_name").cast(pl.Categorical))
+
+
+def run_partitioned(
+    rx: pl.LazyFrame,
+    plan_fn: Callable[[pl.LazyFrame], pl.LazyFrame],
+    key: str = "eid",
+    n_partitions: int | None = None,
+    min_rows: int = 1_000_000,
+) -> pl.LazyFrame:
+    """
+    Apply `plan_fn` separately to hash partitions of the records on `key`, running the
+    partition plans in parallel. All records of a given `key` fall in the same
+    partition, so `plan_fn` must only depend on windows over `key`. Records with fewer
+    than `min_rows` rows are not partitioned (and the plan is kept lazy). By default,
+    `n_partitions` is the number of CPUs.
+    """
+    if n_partitions is None:
+        n_partitions = os.cpu_count() or 1
+    if n_partitions < 2 or rx.select(pl.len()).collect().item() < min_rows:
+        return plan_fn(rx)
+
+    partitions = (
+        rx.with_columns(partition=pl.col(key).hash() % n_partitions)
+        .collect()
+        .partition_by("partition", maintain_order=False, include_key=False)
     )
+    rx = pl.concat(pl.collect_all([plan_fn(p.lazy()) for p in partitions]))
+
+    return rx.lazy()
 
 
 def pipeline(
@@ -49,27 +110,52 @@ def pipeline(
     ukb_demographics: pl.LazyFrame,
     global_rx_dates: pl.LazyFrame,
     return_lazy: bool = True,
-) -> pl.LazyFrame:
-    """Apply all transformations to prescription records."""
+    partitioned: bool = False,
+    output_path: Path | None = None,
+) -> pl.LazyFrame | pl.DataFrame:
+    """
+    Apply all transformations to prescription records. If `partitioned`, the per-`eid`
+    transformations (discontinuation, dosage, and switching) are run in parallel over
+    hash partitions of `eid`s. If `output_path` is given, the transformed records are
+    collected, written to a parquet file, and returned as a DataFrame.
+    """
     # get maximum issue date in global_rx_dates
     max_global_rx_issue_date = (
         global_rx_dates.select("max_global_rx_issue_date").max().collect().item()
     )
 
+    # (joins are kept lazy so projections/predicates are pushed down to the scans)
     rx = (
-        rx.collect()
-        .join(ukb_demographics.collect(), on="eid", how="left")
-        .join(global_rx_dates.collect(), on="eid", how="left")
+        rx.join(ukb_demographics, on="eid", how="left")
+        .join(global_rx_dates, on="eid", how="left")
         .pipe(calculate_rx_end_date)
-        .pipe(discontinuation_pipeline, max_global_rx_issue_date)
-        .pipe(dosage_pipeline)
-        .pipe(identify_switches)
-        .pipe(select_columns)
-        .sort("eid", "issue_date")
     )
 
-    # if not return_lazy:
-    #     return rx.collect()
+    # per-eid transformations (expected durations above are computed across eids, so
+    # are not partitioned)
+    def eid_pipeline(rx: pl.LazyFrame) -> pl.LazyFrame:
+        return (
+            rx.pipe(discontinuation_pipeline, max_global_rx_issue_date)
+            .pipe(dosage_pipeline)
+            .pipe(identify_switches)
+        )
+
+    if partitioned:
+        rx = rx.pipe(run_partitioned, eid_pipeline)
+    else:
+        rx = rx.pipe(eid_pipeline)
+
+    rx = rx.pipe(select_columns).sort("eid", "issue_date")
+
+    if output_path is not None:
+        # (the plan's windows and joins cannot be streamed to file with `sink_parquet`,
+        # so records are collected once, written, and returned without re-reading)
+        rx = rx.collect(streaming=True)
+        rx.write_parquet(output_path, compression="zstd", row_group_size=128_000)
+        return rx
+
+    if not return_lazy:
+        return rx.collect(streaming=True)
 
     return rx
 
@@ -114,43 +200,58 @@ def main() -> None:
         type=Path,
         default="/scratch/prj/premandm/usr/luke/rx_data/statins/statins_processed.parquet",
     )
+    parser.add_argument("-p", "--partitioned", action="store_true")
 
     # parse the arguments
     args = parser.parse_args()
 
+    # (share categorical encodings of generic names across all frames, see
+    # `encode_generic_names`)
+    pl.enable_string_cache()
+
     # load data
     print("Reading datasets...", end=" ")
-    rx: pl.LazyFrame = pl.scan_parquet(args.rx_records).rename({"f.eid": "eid"})
+    rx: pl.LazyFrame = (
+        pl.scan_parquet(args.rx_records)
+        .rename({"f.eid": "eid"})
+        .select(RX_RECORDS_COLUMNS)
+        # (generic names, and so `switch_to_drug`, are categorical in processed records)
+        .pipe(encode_generic_names)
+    )
     ukb_demographics: pl.LazyFrame = (
         pl.scan_parquet(args.demographics)
         .rename({"f.eid": "eid", "date_of_death_first_visit": "date_of_death"})
         .select("eid", "date_of_death")
     )
-    global_rx_dates: pl.LazyFrame = pl.scan_parquet(args.global_rx_dates).rename(
-        {
-            "f.eid": "eid",
-            "min_issue_date": "min_global_rx_issue_date",
-            "max_issue_date": "max_global_rx_issue_date",
-        }
+    global_rx_dates: pl.LazyFrame = (
+        pl.scan_parquet(args.global_rx_dates)
+        .rename(
+            {
+                "f.eid": "eid",
+                "min_issue_date": "min_global_rx_issue_date",
+                "max_issue_date": "max_global_rx_issue_date",
+            }
+        )
+        .select("eid", "min_global_rx_issue_date", "max_global_rx_issue_date")
     )
     print("done.")
 
-    # apply transformations
-    print("Applying transformation pipeline...", end=" ")
-    rx_processed: pl.LazyFrame = pipeline(
-        rx, ukb_demographics, global_rx_dates, return_lazy=False
-    )
-    print(rx_processed.columns)
-    print("done.")
-
-    # write processed rx dataframe to local parquet file
+    # apply transformations and write processed rx records to local parquet file
     print(
-        "Writing transformed prescription records to",
+        "Applying transformation pipeline and writing transformed prescription records "
+        "to",
         args.output,
         "...",
         end=" ",
     )
-    rx_processed.write_parquet(args.output)
+    rx_processed: pl.DataFrame = pipeline(
+        rx,
+        ukb_demographics,
+        global_rx_dates,
+        partitioned=args.partitioned,
+        output_path=args.output,
+    )
+    print(rx_processed.columns)
     print("done.")
 
     # show first rows of processed rx dataframe
@@ -8,21 +8,18 @@ def generate_eid_rx_summary(
     out_path: Path = Path("data") / "statins" / "rx_summary.parquet",
 ) -> pl.LazyFrame:
     """"""
+    # a new period starts at each discontinuation, switch, or change in drug
+    new_period = (
+        pl.col("discontinued")
+        | pl.col("is_switch")
+        | (pl.col("generic_name") != pl.col("generic_name").shift()).fill_null(False)
+    )
+
     # transform prescription records to show continuous prescribing periods
     summary = (
         rx.sort("eid", "issue_date")
-        .with_columns(
-            period=(
-                pl.col("discontinued")
-                | pl.col("is_switch")
-                | (
-                    (pl.col("generic_name") != pl.col("generic_name").shift())
-                    .over("eid")
-                    .fill_null(False)
-                )
-            )
-        )
-        .with_columns(pl.col("period").cum_sum().over("eid"))
+        # label periods with a single window pass
+        .with_columns(period=new_period.cum_sum().over("eid"))
         .group_by("eid", "period")
         .agg(
             pl.col("generic_name").first(),
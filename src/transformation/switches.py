@@ -18,18 +18,12 @@ def identify_switches(
         rx = rx.pipe(identify_discontinuations, max_global_rx_issue_date)
 
     # define polars expressions
-    prev_rx_count = (pl.col("index") - pl.col("index").first() + 1).over(
-        "eid", "generic_name"
-    )
-    consecutive_rx_count = (pl.col("index").last() - pl.col("index")).over(
-        "eid", "generic_name"
-    )
     is_switch = (
-        (pl.col("generic_name") != pl.col("generic_name").shift(-1)).over("eid")
-        & (pl.col("discontinued") is not True)
-        & (prev_rx_count >= min_switch_from_rx)
-        & (prev_rx_count <= max_switch_from_rx)
-        & (consecutive_rx_count.shift(-1) >= min_switch_to_rx)
+        (pl.col("generic_name") != pl.col("next_generic_name"))
+        & ~pl.col("discontinued")
+        & (pl.col("prev_rx_count") >= min_switch_from_rx)
+        & (pl.col("prev_rx_count") <= max_switch_from_rx)
+        & (pl.col("next_consecutive_rx_count") >= min_switch_to_rx)
         & (
             pl.col("first_issue_date")
             >= pl.col("min_global_rx_issue_date") + pl.duration(days=365)
@@ -39,20 +33,39 @@ def identify_switches(
             <= pl.col("max_global_rx_issue_date") - pl.duration(days=365)
         )
     )
+    # (reads the `is_switch` column, so the switch logic is evaluated only once)
     switch_to_drug = (
-        pl.when(is_switch)
-        .then(pl.col("generic_name").shift(-1).over("eid"))
-        .otherwise(None)
+        pl.when(pl.col("is_switch")).then(pl.col("next_generic_name")).otherwise(None)
     )
 
-    # apply polars expressions
+    # apply polars expressions (computing window columns once per partition key)
+    # (rx counts are row index differences, so count all of an eid's records since the
+    # first/until the last prescription of the drug, including other drugs in between)
     rx = (
         rx.with_row_index()
         .with_columns(
-            is_switch=is_switch,
-            switch_to_drug=switch_to_drug,
+            prev_rx_count=(pl.col("index") - pl.col("index").first() + 1).over(
+                "eid", "generic_name"
+            ),
+            consecutive_rx_count=(pl.col("index").last() - pl.col("index")).over(
+                "eid", "generic_name"
+            ),
+        )
+        .with_columns(
+            next_generic_name=pl.col("generic_name").shift(-1).over("eid"),
+            next_consecutive_rx_count=pl.col("consecutive_rx_count")
+            .shift(-1)
+            .over("eid"),
+        )
+        .with_columns(is_switch=is_switch)
+        .with_columns(switch_to_drug=switch_to_drug)
+        .drop(
+            "index",
+            "prev_rx_count",
+            "consecutive_rx_count",
+            "next_generic_name",
+            "next_consecutive_rx_count",
         )
-        .drop("index")
     )
 
     return rx
@@ -1,211 +1,136 @@
 from pathlib import Path
+from typing import Dict, List
 
+import numpy as np
 import polars as pl
 import plotly.graph_objects as go
 
 
-# Read discontinuation summary files to polars dataframes
+# Scan discontinuation summary files to polars lazyframes
 data_dir = Path("data") / "statins"
-ds_all = pl.read_csv(data_dir / "discontinuation_sample_size.csv").with_columns(
-    drug=pl.lit("all")
-)
-ds_sim_ator = pl.read_csv(
-    data_dir / "discontinuation_sample_size_simvastatin_atorvastatin.csv"
-).with_columns(drug=pl.lit("simvastatin_atorvastatin"))
-ds_sim = pl.read_csv(
-    data_dir / "discontinuation_sample_size_simvastatin.csv"
-).with_columns(drug=pl.lit("simvastatin"))
-ds_ator = pl.read_csv(
-    data_dir / "discontinuation_sample_size_atorvastatin.csv"
-).with_columns(drug=pl.lit("atorvastatin"))
+summary_files = [
+    (data_dir / "discontinuation_sample_size.parquet", "all"),
+    (
+        data_dir / "discontinuation_sample_size_simvastatin_atorvastatin.parquet",
+        "simvastatin_atorvastatin",
+    ),
+    (data_dir / "discontinuation_sample_size_simvastatin.parquet", "simvastatin"),
+    (data_dir / "discontinuation_sample_size_atorvastatin.parquet", "atorvastatin"),
+]
 
-# Concatenate summary dataframes to single dataframe and clean column names
+# Concatenate summary lazyframes to single lazyframe
 summary = (
     pl.concat(
         [
-            ds_all,
-            ds_sim_ator,
-            ds_sim,
-            ds_ator,
+            pl.scan_parquet(file).with_columns(drug=pl.lit(drug))
+            for file, drug in summary_files
         ]
     )
-    .sort("drug")
+    .sort("drug", maintain_order=True)
     .with_columns(pl.col("Group").replace("Total Statin Users", "Total Users"))
-).rename(
-    lambda col_name: col_name.lower()
+)
+
+# Clean column names with a precomputed mapping and collect to dataframe (collected
+# once, after all files are read and cleaned in a single plan)
+column_name_map = {
+    col_name: col_name.lower()
     .replace("total", "")
     .replace("count / ", "prop")
     .replace(" ", "_")
-)
+    for col_name in summary.columns
+}
+if len(set(column_name_map.values())) != len(column_name_map):
+    raise ValueError(f"Cleaned column names are not unique: {column_name_map}")
+summary = summary.rename(column_name_map).collect()
 
 
-# Initialize plotly figure
-fig = go.Figure()
+# Define metrics to plot (and corresponding group columns, as x-axes)
+metrics = [
+    ("count", "group"),
+    ("prop_statin_users", "group"),
+    ("prop_discontinuers", "discontinuer_group"),
+]
 
-# Add traces to figure
-fig.add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "all").select("group").to_series().to_list(),
-        y=summary.filter(pl.col("drug") == "all").select("count").to_series().to_list(),
-        name="count_all",
-    )
-).add_trace(
-    go.Bar(
-        x=summary.filter(pl.col("drug") == "simvastatin_atorvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "simvastatin_atorvastatin")
-        .select("count")
-        .to_series()
-        .to_list(),
-        name="count_simvastatin_atorvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "simvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "simvastatin")
-        .select("count")
-        .to_series()
-        .to_list(),
-        name="count_simvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "atorvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "atorvastatin")
-        .select("count")
-        .to_series()
-        .to_list(),
-        name="count_atorvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "all").select("group").to_series().to_list(),
-        y=summary.filter(pl.col("drug") == "all")
-        .select("prop_statin_users")
-        .to_series()
-        .to_list(),
-        name="prop_statin_users_all",
-    )
-).add_trace(
-    go.Bar(
-        x=summary.filter(pl.col("drug") == "simvastatin_atorvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "simvastatin_atorvastatin")
-        .select("prop_statin_users")
-        .to_series()
-        .to_list(),
-        name="prop_statin_users_simvastatin_atorvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "simvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "simvastatin")
-        .select("prop_statin_users")
-        .to_series()
-        .to_list(),
-        name="prop_statin_users_simvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "atorvastatin")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "atorvastatin")
-        .select("prop_statin_users")
-        .to_series()
-        .to_list(),
-        name="prop_statin_users_atorvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(pl.col("drug") == "all", pl.col("group") != "Total Users")
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(pl.col("drug") == "all", pl.col("group") != "Total Users")
-        .select("prop_discontinuers")
-        .to_series()
-        .to_list(),
-        name="prop_discontinuers_all",
-    )
-).add_trace(
-    go.Bar(
-        x=summary.filter(
-            pl.col("drug") == "simvastatin_atorvastatin",
-            pl.col("group") != "Total Users",
-        )
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(
-            pl.col("drug") == "simvastatin_atorvastatin",
-            pl.col("group") != "Total Users",
-        )
-        .select("prop_discontinuers")
-        .to_series()
-        .to_list(),
-        name="prop_discontinuers_simvastatin_atorvastatin",
-    )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(
-            pl.col("drug") == "simvastatin", pl.col("group") != "Total Users"
-        )
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(
-            pl.col("drug") == "simvastatin", pl.col("group") != "Total Users"
-        )
-        .select("prop_discontinuers")
-        .to_series()
-        .to_list(),
-        name="prop_discontinuers_simvastatin",
+
+def get_trace_data(summary: pl.DataFrame) -> Dict[str, Dict[str, list | np.ndarray]]:
+    """
+    Partition summary by drug and extract columns once per drug (filtering out the
+    total users group once for proportions of discontinuers), passing numeric columns
+    to plotly as numpy arrays.
+    """
+    summary_nd = summary.filter(pl.col("group") != "Total Users").partition_by(
+        ["drug"], as_dict=True
     )
-).add_trace(
-    go.Scatter(
-        x=summary.filter(
-            pl.col("drug") == "atorvastatin", pl.col("group") != "Total Users"
-        )
-        .select("group")
-        .to_series()
-        .to_list(),
-        y=summary.filter(
-            pl.col("drug") == "atorvastatin", pl.col("group") != "Total Users"
-        )
-        .select("prop_discontinuers")
-        .to_series()
-        .to_list(),
-        name="prop_discontinuers_atorvastatin",
+    trace_data = {}
+    for (drug,), drug_summary in summary.partition_by(["drug"], as_dict=True).items():
+        discontinuer_summary = summary_nd[(drug,)]
+        trace_data[drug] = {
+            "group": drug_summary.get_column("group").to_list(),
+            "count": drug_summary.get_column("count").to_numpy(),
+            "prop_statin_users": drug_summary.get_column(
+                "prop_statin_users"
+            ).to_numpy(),
+            "discontinuer_group": discontinuer_summary.get_column("group").to_list(),
+            "prop_discontinuers": discontinuer_summary.get_column(
+                "prop_discontinuers"
+            ).to_numpy(),
+        }
+    return trace_data
+
+
+def build_figure() -> go.Figure:
+    """
+    Initialize plotly figure with a single (empty) trace per metric, to be populated
+    by `update_figure` (proportions are plotted against a secondary y-axis, as they
+    are on a different scale to counts).
+    """
+    return go.Figure(
+        data=[
+            go.Bar(name=metric, yaxis="y" if metric == "count" else "y2")
+            for metric, _ in metrics
+        ],
+        layout=dict(
+            yaxis=dict(title="count"),
+            yaxis2=dict(title="proportion", overlaying="y", side="right"),
+        ),
     )
-)
 
-# Add buttons
-fig.update_layout(
-    updatemenus=[
-        dict(
-            active=0,
-            buttons=list(
-                [
+
+def update_figure(fig: go.Figure, summary: pl.DataFrame, drugs: List[str]) -> go.Figure:
+    """
+    Update figure traces in place with `summary` data (showing the first of `drugs`),
+    and add buttons to switch the drug shown by all traces.
+    """
+    trace_data = get_trace_data(summary)
+    with fig.batch_update():
+        for trace, (metric, group_col) in zip(fig.data, metrics):
+            trace.x = trace_data[drugs[0]][group_col]
+            trace.y = trace_data[drugs[0]][metric]
+        fig.layout.updatemenus = [
+            dict(
+                active=0,
+                buttons=[
                     dict(
-                        label=""
+                        label=drug,
+                        method="restyle",
+                        args=[
+                            {
+                                "x": [
+                                    trace_data[drug][group_col]
+                                    for _, group_col in metrics
+                                ],
+                                "y": [
+                                    trace_data[drug][metric] for metric, _ in metrics
+                                ],
+                            }
+                        ],
                     )
-                ]
+                    for drug in drugs
+                ],
             )
-        )
-    ]
-)
\ No newline at end of file
+        ]
+    return fig
+
+
+# Build plotly figure and populate with summary data
+fig = update_figure(build_figure(), summary, [drug for _, drug in summary_files])
@@ -1,8 +1,7 @@
 from pathlib import Path
-from typing import Tuple
+from typing import Dict, Tuple
 
 import polars as pl
-import plotly
 import plotly.graph_objects as go
 
 
@@ -23,9 +22,9 @@ def get_participant_count(
     """
     participant_col = get_col(participant_col)
     if filter_expr is not None:
-        count = rx.select(participant_col.filter(filter_expr)).unique().count()
+        count = rx.select(participant_col.filter(filter_expr).n_unique())
     else:
-        count = rx.select(participant_col).unique().count()
+        count = rx.select(participant_col.n_unique())
     if isinstance(rx, pl.LazyFrame):
         count = count.collect().item()
     else:
@@ -33,116 +32,240 @@ def get_participant_count(
     return count
 
 
+def get_participant_counts(
+    rx: pl.LazyFrame | pl.DataFrame,
+    filter_exprs: Dict[str, pl.Expr | None],
+    participant_col: str = "eid",
+) -> Dict[str, int]:
+    """
+    Identify numbers of participants meeting each of the criteria specified in the
+    `filter_exprs` polars expressions (`None` for all participants), in a single
+    collection.
+    """
+    participant_col = get_col(participant_col)
+    counts = rx.select(
+        [
+            (
+                participant_col.filter(filter_expr)
+                if filter_expr is not None
+                else participant_col
+            )
+            .n_unique()
+            .alias(name)
+            for name, filter_expr in filter_exprs.items()
+        ]
+    )
+    if isinstance(rx, pl.LazyFrame):
+        counts = counts.collect()
+    return counts.row(0, named=True)
+
+
+def add_eid_rx_history_columns(rx: pl.LazyFrame) -> pl.LazyFrame:
+    """
+    Add per `eid` prescription history columns used to count participants, so their
+    window expressions are computed once for all counts.
+    """
+    rx = rx.with_columns(
+        eid_discontinued_count=pl.col("discontinued").sum().over("eid"),
+        eid_restarted_count=pl.col("restarted").sum().over("eid"),
+        prior_discontinued_count=(
+            pl.col("discontinued").cum_sum() - pl.col("discontinued")
+        ).over("eid"),
+        is_final_discontinuation=pl.col("discontinued")
+        & pl.col("issue_date").shift(-1).over("eid").is_null(),
+        time_since_first_rx=(pl.col("issue_date") - pl.col("issue_date").first()).over(
+            "eid"
+        ),
+    )
+    return rx
+
+
 def get_rx_user_count(rx: pl.LazyFrame) -> int:
     return get_participant_count(rx)
 
 
+def get_rx_discontinuer_filter() -> pl.Expr:
+    return pl.col("eid_discontinued_count") > 0
+
+
 def get_rx_discontinuer_count(rx: pl.LazyFrame) -> int:
-    filter_expr = pl.col("discontinued").sum().over("eid") > 0
-    return get_participant_count(rx, filter_expr)
+    if "eid_discontinued_count" not in rx.columns:
+        rx = rx.pipe(add_eid_rx_history_columns)
+    return get_participant_count(rx, get_rx_discontinuer_filter())
 
 
-def get_rx_restarter_count(rx: pl.LazyFrame, max_restarts: int | None = None) -> int:
-    filter_expr = pl.col("restarted").sum().over("eid") > 0
-    if max_restarts:
-        filter_expr = filter_expr & (
-            pl.col("restarted").sum().over("eid") <= max_restarts
-        )
-    return get_participant_count(rx, filter_expr)
+def get_rx_restarter_filter(
+    min_restarts: int = 1, max_restarts: int | None = None
+) -> pl.Expr:
+    filter_expr = pl.col("eid_restarted_count") >= min_restarts
+    if max_restarts is not None:
+        filter_expr = filter_expr & (pl.col("eid_restarted_count") <= max_restarts)
+    return filter_expr
 
 
-def get_rx_final_discontinuation_count(
-    rx: pl.LazyFrame,
+def get_rx_restarter_count(
+    rx: pl.LazyFrame, min_restarts: int = 1, max_restarts: int | None = None
+) -> int:
+    if "eid_restarted_count" not in rx.columns:
+        rx = rx.pipe(add_eid_rx_history_columns)
+    return get_participant_count(
+        rx, get_rx_restarter_filter(min_restarts, max_restarts)
+    )
+
+
+def get_rx_final_discontinuation_filter(
     min_prior_discontinuations: int | None = None,
     max_prior_discontinuations: int | None = None,
     max_time_to_final_discontinuation: pl.Duration | None = None,
-) -> int:
-    filter_expr = pl.col("discontinued") & (
-        pl.col("issue_date").shift(-1).over("eid").is_null()
-    )
+) -> pl.Expr:
+    filter_expr = pl.col("is_final_discontinuation")
     if min_prior_discontinuations is not None:
         filter_expr = filter_expr & (
-            pl.col("discontinued").cum_sum().over("eid").shift()
-            >= min_prior_discontinuations
+            pl.col("prior_discontinued_count") >= min_prior_discontinuations
         )
     if max_prior_discontinuations is not None:
         filter_expr = filter_expr & (
-            pl.col("discontinued").cum_sum().over("eid").shift()
-            <= max_prior_discontinuations
+            pl.col("prior_discontinued_count") <= max_prior_discontinuations
         )
     if max_time_to_final_discontinuation is not None:
         filter_expr = filter_expr & (
-            (pl.col("issue_date") - pl.col("issue_date").first()).over("eid")
-            <= max_time_to_final_discontinuation
+            pl.col("time_since_first_rx") <= max_time_to_final_discontinuation
         )
+    return filter_expr
+
 
+def get_rx_final_discontinuation_count(
+    rx: pl.LazyFrame,
+    min_prior_discontinuations: int | None = None,
+    max_prior_discontinuations: int | None = None,
+    max_time_to_final_discontinuation: pl.Duration | None = None,
+) -> int:
+    if "is_final_discontinuation" not in rx.columns:
+        rx = rx.pipe(add_eid_rx_history_columns)
+    filter_expr = get_rx_final_discontinuation_filter(
+        min_prior_discontinuations,
+        max_prior_discontinuations,
+        max_time_to_final_discontinuation,
+    )
     return get_participant_count(rx, filter_expr)
 
 
-def generate_discontinuation_sankey_diagram(
-    rx: pl.LazyFrame, out_path: Path | None = None, num_years: int = 2
-) -> plotly.graph_objs._figure.Figure:
+def get_discontinuation_sankey_counts(
+    rx: pl.LazyFrame | pl.DataFrame, num_years: int = 2
+) -> Dict[str, int]:
     """
-    Generates a plotly sankey diagram showing the sample sizes and progression of
-    prescription discontinuation/restarts.
+    Compute sankey diagram node/ribbon values (participant counts), computing per eid
+    prescription history columns and all counts in a single collection. The
+    `num_years` used for final discontinuation timing is returned alongside counts.
     """
 
     DAYS_IN_YEAR = 365
 
-    # get node/ribbon values (participant counts)
-    user_count = get_rx_user_count(rx)
-    discontinuer_count = get_rx_discontinuer_count(rx)
-    restarter_count = get_rx_restarter_count(rx)
-    single_restarter_count = get_rx_restarter_count(rx, max_restarts=1)
-    multiple_restarter_count = restarter_count - single_restarter_count
-    final_discontinuation_count = get_rx_final_discontinuation_count(rx)
-    final_discontinuation_no_prior_discontinuations_count = (
-        get_rx_final_discontinuation_count(rx, max_prior_discontinuations=0)
+    # (select only columns used by counts, so window expressions do not carry others,
+    # and sort once, as per eid history columns depend on prescription order; the sort
+    # is stable so records sharing an issue date keep their input order)
+    rx = (
+        rx.lazy()
+        .select(["eid", "discontinued", "restarted", "issue_date"])
+        .sort("eid", "issue_date", maintain_order=True)
     )
-    final_discontinuation_single_prior_discontinuation_count = (
-        get_rx_final_discontinuation_count(
-            rx, min_prior_discontinuations=1, max_prior_discontinuations=1
-        )
-    )
-    final_discontinuation_multiple_prior_discontinuations_count = (
-        get_rx_final_discontinuation_count(rx, min_prior_discontinuations=2)
+
+    counts = get_participant_counts(
+        rx.pipe(add_eid_rx_history_columns),
+        {
+            "user_count": None,
+            "discontinuer_count": get_rx_discontinuer_filter(),
+            "single_restarter_count": get_rx_restarter_filter(max_restarts=1),
+            "multiple_restarter_count": get_rx_restarter_filter(min_restarts=2),
+            "final_discontinuation_count": get_rx_final_discontinuation_filter(),
+            "final_discontinuation_no_prior_discontinuations_count": (
+                get_rx_final_discontinuation_filter(max_prior_discontinuations=0)
+            ),
+            "final_discontinuation_single_prior_discontinuation_count": (
+                get_rx_final_discontinuation_filter(
+                    min_prior_discontinuations=1, max_prior_discontinuations=1
+                )
+            ),
+            "final_discontinuation_multiple_prior_discontinuations_count": (
+                get_rx_final_discontinuation_filter(min_prior_discontinuations=2)
+            ),
+            "final_discontinuation_within_first_year_count": (
+                get_rx_final_discontinuation_filter(
+                    max_time_to_final_discontinuation=pl.duration(
+                        days=DAYS_IN_YEAR * num_years
+                    )
+                )
+            ),
+        },
     )
-    final_discontinuation_within_first_year_count = get_rx_final_discontinuation_count(
-        rx, max_time_to_final_discontinuation=pl.duration(days=DAYS_IN_YEAR * num_years)
+    counts["restarter_count"] = (
+        counts["single_restarter_count"] + counts["multiple_restarter_count"]
     )
-    final_discontinuation_after_first_year_count = (
-        final_discontinuation_count - final_discontinuation_within_first_year_count
+    counts["final_discontinuation_after_first_year_count"] = (
+        counts["final_discontinuation_count"]
+        - counts["final_discontinuation_within_first_year_count"]
     )
-    continuer_count = (user_count - discontinuer_count) + (
-        restarter_count
-        - final_discontinuation_single_prior_discontinuation_count
-        - final_discontinuation_multiple_prior_discontinuations_count
+    counts["continuer_count"] = (
+        counts["user_count"] - counts["discontinuer_count"]
+    ) + (
+        counts["restarter_count"]
+        - counts["final_discontinuation_single_prior_discontinuation_count"]
+        - counts["final_discontinuation_multiple_prior_discontinuations_count"]
     )
+    counts["num_years"] = num_years
+    return counts
 
-    # define node labels
-    node_labels = [
-        f"Users ({user_count:,})",  # node 0
-        f"Continuers ({continuer_count:,})",  # node 1
-        f"Discontinuers ({discontinuer_count:,})",  # node 2
-        f"Restarters ({restarter_count:,})",  # node 3
-        ("Single Restart " f"({single_restarter_count:,})",),  # node 4
-        ("Multiple Restarts " f"({multiple_restarter_count:,})",),  # node 5
-        f"Final Discontinuation ({final_discontinuation_count:,})",  # node 6
-        f"After Year {num_years} ({final_discontinuation_after_first_year_count:,})",  # node 7
-        f"Within Year {num_years} ({final_discontinuation_within_first_year_count:,})",  # node 8
+
+def build_discontinuation_sankey_diagram(counts: Dict[str, int]) -> go.Figure:
+    """
+    Build a plotly sankey diagram from participant `counts` (see
+    `get_discontinuation_sankey_counts`), labelling final discontinuation timing with
+    the `num_years` the counts were computed with.
+    """
+
+    num_years = counts["num_years"]
+    user_count = counts["user_count"]
+    continuer_count = counts["continuer_count"]
+    discontinuer_count = counts["discontinuer_count"]
+    restarter_count = counts["restarter_count"]
+    single_restarter_count = counts["single_restarter_count"]
+    multiple_restarter_count = counts["multiple_restarter_count"]
+    final_discontinuation_count = counts["final_discontinuation_count"]
+    final_discontinuation_no_prior_discontinuations_count = counts[
+        "final_discontinuation_no_prior_discontinuations_count"
+    ]
+    final_discontinuation_single_prior_discontinuation_count = counts[
+        "final_discontinuation_single_prior_discontinuation_count"
+    ]
+    final_discontinuation_multiple_prior_discontinuations_count = counts[
+        "final_discontinuation_multiple_prior_discontinuations_count"
+    ]
+    final_discontinuation_within_first_year_count = counts[
+        "final_discontinuation_within_first_year_count"
+    ]
+    final_discontinuation_after_first_year_count = counts[
+        "final_discontinuation_after_first_year_count"
     ]
 
-    [
-        ("Users", 0),
-        ("Continuers", 1),
-        ("Discontinuers", 2),
-        ("Restarters", 3),
-        ("Single Restart", 4),
-        ("Multiple Restarts", 5),
-        ("Final Discontinuation", 6),
-        ("After 1st Year", 7),
-        ("Within First Year", 8),
+    # define node labels
+    node_label_counts = [
+        ("Users", user_count),  # node 0
+        ("Continuers", continuer_count),  # node 1
+        ("Discontinuers", discontinuer_count),  # node 2
+        ("Restarters", restarter_count),  # node 3
+        ("Single Restart", single_restarter_count),  # node 4
+        ("Multiple Restarts", multiple_restarter_count),  # node 5
+        ("Final Discontinuation", final_discontinuation_count),  # node 6
+        (
+            f"After Year {num_years}",
+            final_discontinuation_after_first_year_count,
+        ),  # node 7
+        (
+            f"Within Year {num_years}",
+            final_discontinuation_within_first_year_count,
+        ),  # node 8
     ]
+    node_labels = [f"{name} ({count:,})" for name, count in node_label_counts]
 
     # define node colors
     node_colors = [
@@ -161,62 +284,24 @@ def generate_discontinuation_sankey_diagram(
     # TODO: ^
 
     # define node links
-    node_links = [
-        {"source_label_index": 0, "target_label_index": 1, "value": continuer_count},
-        {"source_label_index": 0, "target_label_index": 2, "value": discontinuer_count},
-        {"source_label_index": 2, "target_label_index": 3, "value": restarter_count},
-        {
-            "source_label_index": 2,
-            "target_label_index": 6,
-            "value": final_discontinuation_no_prior_discontinuations_count,
-        },
-        {
-            "source_label_index": 3,
-            "target_label_index": 4,
-            "value": single_restarter_count,
-        },
-        {
-            "source_label_index": 3,
-            "target_label_index": 5,
-            "value": multiple_restarter_count,
-        },
-        {
-            "source_label_index": 4,
-            "target_label_index": 6,
-            "value": final_discontinuation_single_prior_discontinuation_count,
-        },
-        {
-            "source_label_index": 4,
-            "target_label_index": 1,
-            "value": (
-                single_restarter_count
-                - final_discontinuation_single_prior_discontinuation_count
-            ),
-        },
-        {
-            "source_label_index": 5,
-            "target_label_index": 6,
-            "value": final_discontinuation_multiple_prior_discontinuations_count,
-        },
-        {
-            "source_label_index": 5,
-            "target_label_index": 1,
-            "value": (
-                multiple_restarter_count
-                - final_discontinuation_multiple_prior_discontinuations_count
-            ),
-        },
-        {
-            "source_label_index": 6,
-            "target_label_index": 7,
-            "value": final_discontinuation_after_first_year_count,
-        },
-        {
-            "source_label_index": 6,
-            "target_label_index": 8,
-            "value": final_discontinuation_within_first_year_count,
-        },
-    ]
+    link_sources = (0, 0, 2, 2, 3, 3, 4, 4, 5, 5, 6, 6)
+    link_targets = (1, 2, 3, 6, 4, 5, 6, 1, 6, 1, 7, 8)
+    link_values = (
+        continuer_count,
+        discontinuer_count,
+        restarter_count,
+        final_discontinuation_no_prior_discontinuations_count,
+        single_restarter_count,
+        multiple_restarter_count,
+        final_discontinuation_single_prior_discontinuation_count,
+        single_restarter_count
+        - final_discontinuation_single_prior_discontinuation_count,
+        final_discontinuation_multiple_prior_discontinuations_count,
+        multiple_restarter_count
+        - final_discontinuation_multiple_prior_discontinuations_count,
+        final_discontinuation_after_first_year_count,
+        final_discontinuation_within_first_year_count,
+    )
 
     # plot sankey diagram
     fig = go.Figure(
@@ -232,14 +317,39 @@ def generate_discontinuation_sankey_diagram(
                     color=node_colors,
                 ),
                 link=dict(
-                    source=[node["source_label_index"] for node in node_links],
-                    target=[node["target_label_index"] for node in node_links],
-                    value=[node["value"] for node in node_links],
+                    source=link_sources,
+                    target=link_targets,
+                    value=link_values,
                 ),
             )
         ]
     )
 
+    return fig
+
+
+def generate_discontinuation_sankey_diagram(
+    rx: pl.LazyFrame,
+    out_path: Path | None = None,
+    num_years: int = 2,
+    counts: Dict[str, int] | None = None,
+) -> go.Figure:
+    """
+    Generates a plotly sankey diagram showing the sample sizes and progression of
+    prescription discontinuation/restarts. Participant `counts` previously computed
+    from `rx` with `get_discontinuation_sankey_counts` may be given, so repeated calls
+    (e.g. saving to multiple `out_path`s) do not recompute them.
+    """
+
+    if counts is None:
+        counts = get_discontinuation_sankey_counts(rx, num_years)
+    elif counts["num_years"] != num_years:
+        raise ValueError(
+            f"counts were computed with num_years={counts['num_years']}, not "
+            f"num_years={num_years}"
+        )
+    fig = build_discontinuation_sankey_diagram(counts)
+
     # optionally, save figure to out_path
     if out_path:
         fig.write_image(out_path)
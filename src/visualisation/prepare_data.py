@@ -0,0 +1,9 @@
+from pathlib import Path
+
+import polars as pl
+
+# Convert discontinuation summary csv files to parquet files (written alongside the
+# csv files), so plotting scripts avoid re-parsing csv files on every run
+data_dir = Path("data") / "statins"
+for csv_file in sorted(data_dir.glob("discontinuation_sample_size*.csv")):
+    pl.scan_csv(csv_file).sink_parquet(csv_file.with_suffix(".parquet"))
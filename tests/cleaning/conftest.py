@@ -0,0 +1,12 @@
+import pytest
+
+# (the cleaning modules import `utils` as a top level module, so patch that module)
+import utils
+
+
+@pytest.fixture(autouse=True)
+def no_rxclass_api(monkeypatch):
+    """Prevent drug objects from requesting their class from the RxClass API."""
+    monkeypatch.setattr(
+        utils, "find_rxcui_and_class_using_rxclass_api", lambda *args: None
+    )
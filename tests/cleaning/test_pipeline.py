@@ -0,0 +1,36 @@
+import polars as pl
+from cleaning.pipeline import create_drugs, extract_drug_info
+
+
+def test_extract_drug_info_pairs_combination_drug_strengths():
+    drugs = create_drugs(
+        {
+            "simvastatin": ["zocor", "inegy"],
+            "atorvastatin": ["lipitor"],
+            "ezetimibe": ["inegy"],
+        }
+    )
+    rx = pl.LazyFrame(
+        {
+            "prescription_text": [
+                "Inegy 10mg/20mg tablets",
+                "Inegy 10mg/40mg tablets",
+                "Ezetimibe 10mg / Simvastatin 80mg tablets",
+                "Simvastatin 20mg tablets",
+            ]
+        }
+    )
+
+    drug_info = (
+        extract_drug_info(rx, drugs, generic_names_remove=["ezetimibe"])
+        .select("prescription_text", "generic_name", "strength_amt")
+        .collect()
+        .sort("prescription_text")
+    )
+
+    assert drug_info.rows() == [
+        ("Ezetimibe 10mg / Simvastatin 80mg tablets", "simvastatin", 80.0),
+        ("Inegy 10mg/20mg tablets", "simvastatin", 20.0),
+        ("Inegy 10mg/40mg tablets", "simvastatin", 40.0),
+        ("Simvastatin 20mg tablets", "simvastatin", 20.0),
+    ]
@@ -0,0 +1,11 @@
+import sys
+from pathlib import Path
+
+src_dir = Path(__file__).resolve().parents[1] / "src"
+
+# modules under test are imported by package path (e.g. `from cleaning import
+# pipeline`), as cleaning and transformation both have a `pipeline` module; their
+# directories are appended so the modules' own sibling imports resolve (e.g. `from
+# utils import Drug`)
+sys.path.insert(0, str(src_dir))
+sys.path.extend([str(src_dir / "cleaning"), str(src_dir / "transformation")])
@@ -0,0 +1,77 @@
+from datetime import date, timedelta
+
+import polars as pl
+from transformation.discontinuations import (
+    discontinuation_pipeline,
+    get_drugs_first_issue_date_for_eid,
+)
+
+
+def make_rx(issue_dates: dict) -> pl.LazyFrame:
+    """
+    Build simvastatin prescription records of 30 day durations from `issue_dates` per
+    eid, in the given (not necessarily sorted) order.
+    """
+    records = [
+        (eid, issue_date)
+        for eid, eid_issue_dates in issue_dates.items()
+        for issue_date in eid_issue_dates
+    ]
+    rx = pl.LazyFrame(
+        {
+            "eid": [eid for eid, _ in records],
+            "generic_name": "simvastatin",
+            "issue_date": [issue_date for _, issue_date in records],
+            "expected_rx_duration": pl.Series(
+                [timedelta(days=30)] * len(records), dtype=pl.Duration("ms")
+            ),
+            "date_of_death": pl.Series([None] * len(records), dtype=pl.Date),
+            "min_global_rx_issue_date": date(2010, 1, 1),
+            "max_global_rx_issue_date": date(2016, 1, 1),
+        }
+    )
+    return rx.with_columns(
+        next_issue_date=pl.col("issue_date")
+        .sort()
+        .shift(-1)
+        .gather(pl.col("issue_date").arg_sort().arg_sort())
+        .over("eid"),
+        expected_rx_end_date=pl.col("issue_date") + pl.col("expected_rx_duration"),
+    )
+
+
+def test_first_issue_date_is_earliest_for_out_of_order_records():
+    rx = make_rx({1: [date(2011, 3, 1), date(2010, 12, 1), date(2011, 1, 15)]})
+
+    first_issue_dates = (
+        rx.pipe(get_drugs_first_issue_date_for_eid)
+        .collect()
+        .get_column("first_issue_date")
+    )
+
+    assert first_issue_dates.to_list() == [date(2010, 12, 1)] * 3
+
+
+def test_discontinuation_pipeline_uses_earliest_issue_date_for_out_of_order_records():
+    # eid 1 started treatment within a year of the start of their records (so is not
+    # a new user and cannot discontinue), but their records are given in reverse order
+    # so the first record is after that year; eid 2 is a new user who discontinues
+    rx = make_rx(
+        {
+            1: [date(2011, 3, 1), date(2010, 12, 1)],
+            2: [date(2012, 2, 1), date(2012, 1, 1)],
+        }
+    )
+
+    discontinuations = (
+        rx.pipe(discontinuation_pipeline, date(2016, 1, 1))
+        .select("eid", "issue_date", "first_issue_date", "discontinued")
+        .collect()
+    )
+
+    assert discontinuations.rows() == [
+        (1, date(2010, 12, 1), date(2010, 12, 1), False),
+        (1, date(2011, 3, 1), date(2010, 12, 1), False),
+        (2, date(2012, 1, 1), date(2012, 1, 1), False),
+        (2, date(2012, 2, 1), date(2012, 1, 1), True),
+    ]
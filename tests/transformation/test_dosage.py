@@ -0,0 +1,29 @@
+import polars as pl
+import pytest
+from transformation.dosage import map_discrete_dosage_to_intensity
+
+
+@pytest.mark.parametrize(
+    "generic_name_dtype",
+    [pl.Utf8, pl.Categorical, pl.Enum(["simvastatin", "atorvastatin"])],
+)
+def test_map_discrete_dosage_to_intensity_ignores_drugs_missing_from_records(
+    generic_name_dtype,
+):
+    # (default intensity ranges include fluvastatin, pravastatin and rosuvastatin,
+    # which are missing from the records, and from the enum of their generic names;
+    # categorical generic names share the string cache, as in the pipeline)
+    with pl.StringCache():
+        rx = pl.LazyFrame(
+            {
+                "generic_name": pl.Series(
+                    ["simvastatin", "simvastatin", "atorvastatin", "atorvastatin"],
+                    dtype=generic_name_dtype,
+                ),
+                "discrete_dosage_per_day": [10, 80, 10, 30],
+            }
+        )
+        intensity = map_discrete_dosage_to_intensity(rx).collect()
+
+    assert intensity.height == 4
+    assert intensity.get_column("dosage_intensity").to_list() == [1, 3, 2, None]